@@ -1,7 +1,10 @@
+import logging
 import psycopg2
 from psycopg2 import sql
-from typing import List, Tuple
-import random
+from typing import Any, List, Tuple
+
+
+logger = logging.getLogger(__name__)
 
 
 def connect_to_database(
@@ -30,95 +33,115 @@ def connect_to_database(
         )
         return connection
     except psycopg2.Error as e:
-        print("Error connecting to the database:", e)
+        logger.error("Error connecting to the database: %s", e)
 
 
-def get_primary_key_values(
-        connection: psycopg2.extensions.connection,
+def sample_primary_key_values(
+        cursor: psycopg2.extensions.cursor,
         table_name: str,
-        primary_key_field: str
+        primary_key_field: str,
+        sample_size: int
         ) -> List[Tuple]:
     """
-    Retrieve the primary key values from the specified table.
+    Randomly sample primary key values from the specified table.
+    The sampling is done by the database, so only the sampled values are transferred.
 
     Args:
-        connection (psycopg2.extensions.connection): The database connection object.
+        cursor (psycopg2.extensions.cursor): The database cursor object.
         table_name (str): Name of the table.
         primary_key_field (str): Name of the primary key field.
+        sample_size (int): Number of primary key values to sample.
 
     Returns:
-        List[Tuple]: The primary key values.
+        List[Tuple]: The sampled primary key values.
     """
     try:
-        cursor = connection.cursor()
-
-        # Retrieve the primary key values from the table
-        cursor.execute(sql.SQL("SELECT {} FROM {}").format(
+        # Retrieve a random sample of the primary key values from the table
+        cursor.execute(sql.SQL("SELECT {} FROM {} ORDER BY random() LIMIT %s").format(
             sql.Identifier(primary_key_field),
             sql.Identifier(table_name)
-        ))
+        ), (sample_size,))
         primary_key_values = cursor.fetchall()
-
-        cursor.close()
         return primary_key_values
     except psycopg2.Error as e:
-        print("Error retrieving primary key values:", e)
+        logger.error("Error sampling primary key values: %s", e)
+        raise
 
 
-def get_table_names(connection: psycopg2.extensions.connection) -> List[str]:
+def _table_exists(cursor: psycopg2.extensions.cursor, table_name: str) -> bool:
     """
-    Retrieves the list of table names in the database.
+    Check whether a relation with the given name already exists.
 
     Args:
-        connection (psycopg2.extensions.connection): The database connection object.
+        cursor (psycopg2.extensions.cursor): The database cursor object.
+        table_name (str): Name of the table to look up.
 
     Returns:
-        List[str]: The list of table names.
+        bool: True if the name is taken, False otherwise.
     """
-    try:
-        cursor = connection.cursor()
+    # Quote the name so that to_regclass does not fold it to lower case
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (sql.Identifier(table_name).as_string(cursor),))
+    return cursor.fetchone()[0]
+
 
-        # Retrieve the list of table names
-        cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-        table_names = [row[0] for row in cursor.fetchall()]
+def get_column_type(cursor: psycopg2.extensions.cursor, table_name: str, column_name: str) -> str:
+    """
+    Retrieve the SQL type of a column, e.g. to cast a key array to the primary key type.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor object.
+        table_name (str): Name of the table.
+        column_name (str): Name of the column.
 
-        cursor.close()
-        return table_names
+    Returns:
+        str: The SQL type of the column.
+
+    Raises:
+        psycopg2.ProgrammingError: If the table or column does not exist.
+    """
+    try:
+        cursor.execute(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = to_regclass(%s) AND attname = %s AND NOT attisdropped",
+            (sql.Identifier(table_name).as_string(cursor), column_name)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise psycopg2.ProgrammingError(f'column "{column_name}" of relation "{table_name}" does not exist')
+        return row[0]
     except psycopg2.Error as e:
-        print("Error retrieving table names:", e)
+        logger.error("Error retrieving column type: %s", e)
+        raise
 
 
-def backup_records(
-        connection: psycopg2.extensions.connection,
+def create_backup_table(
+        cursor: psycopg2.extensions.cursor,
         table_name: str,
-        backup_table_name: str,
-        primary_key_field: str,
-        primary_key_values: List[Tuple]
-        ) -> None:
+        backup_table_name: str
+        ) -> str:
     """
-    Safely backs up the identified records to a separate backup table.
+    Creates an empty backup table with the same structure as the original table.
+    The table is created in the current transaction, which is left for the caller to commit.
 
     Args:
-        connection (psycopg2.extensions.connection): The database connection object.
+        cursor (psycopg2.extensions.cursor): The database cursor object.
         table_name (str): Name of the table containing the records.
         backup_table_name (str): Name of the table to back up the records.
-        primary_key_field (str): Name of the field designated as primary key.   
-        primary_key_values (List[Tuple]): List of primary key values identifying the records to back up.
+
+    Returns:
+        str: The name of the created backup table, suffixed with a version if the requested name was taken.
     """
     try:
-        cursor = connection.cursor()
-
-        # Create a backup table with the same structure as the original table
         # Check if the target table name already exists
-        table_names = get_table_names(connection)
+        original_backup_table_name = backup_table_name
         duplicate_exists = False
         version = 1
-        while backup_table_name in table_names:
+        while _table_exists(cursor, backup_table_name):
             duplicate_exists = True
-            backup_table_name = f"{backup_table_name}_v{version}"
+            backup_table_name = f"{original_backup_table_name}_v{version}"
             version += 1
         if duplicate_exists:
-          print(f"Backup table name already exists. It will be renamed to {backup_table_name}.")
+          logger.info("Backup table name already exists. It will be renamed to %s.", backup_table_name)
 
         # Create the target table with the same structure as the source table
         cursor.execute(sql.SQL("CREATE TABLE {} (LIKE {})").format(
@@ -126,93 +149,179 @@ def backup_records(
             sql.Identifier(table_name)
         ))
 
-        # Copy the identified records into the backup table
-        for primary_key_value in primary_key_values:
-            cursor.execute(sql.SQL("INSERT INTO {} SELECT * FROM {} WHERE {} = %s").format(
-                sql.Identifier(backup_table_name),
-                sql.Identifier(table_name),
-                sql.Identifier(primary_key_field)
-            ), primary_key_value)
-        connection.commit()
-        cursor.close()
-        print(f"These records {primary_key_values} are backed up successfully to {backup_table_name}.")
+        return backup_table_name
     except psycopg2.Error as e:
-        connection.rollback()
-        print("Error backing up records:", e)
+        logger.error("Error creating backup table: %s", e)
+        raise
+
+
+def backup_records(
+        cursor: psycopg2.extensions.cursor,
+        table_name: str,
+        backup_table_name: str,
+        primary_key_field: str,
+        primary_key_type: str,
+        primary_key_values: List[Any]
+        ) -> None:
+    """
+    Safely backs up the identified records to a separate backup table.
+    The changes are made in the current transaction, which is left for the caller to commit.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor object.
+        table_name (str): Name of the table containing the records.
+        backup_table_name (str): Name of the table to back up the records.
+        primary_key_field (str): Name of the field designated as primary key.   
+        primary_key_type (str): SQL type of the primary key field, as returned by get_column_type.
+        primary_key_values (List[Any]): List of primary key values identifying the records to back up.
+    """
+    backup_table_name = create_backup_table(cursor, table_name, backup_table_name)
+
+    try:
+        # Copy the identified records into the backup table in a single statement
+        cursor.execute(sql.SQL(
+            "INSERT INTO {dst} SELECT * FROM {src} WHERE {pk} IN (SELECT unnest(%s::{pk_type}[]))"
+        ).format(
+            dst=sql.Identifier(backup_table_name),
+            src=sql.Identifier(table_name),
+            pk=sql.Identifier(primary_key_field),
+            pk_type=sql.SQL(primary_key_type)
+        ), (primary_key_values,))
+        logger.info("%d records from %s backed up successfully to %s.", cursor.rowcount, table_name, backup_table_name)
+    except psycopg2.Error as e:
+        logger.error("Error backing up records: %s", e)
+        raise
+
+
+def move_records(
+        cursor: psycopg2.extensions.cursor,
+        table_name: str,
+        backup_table_name: str,
+        primary_key_field: str,
+        primary_key_type: str,
+        primary_key_values: List[Any]
+        ) -> None:
+    """
+    Moves the identified records from the original table to the backup table.
+    The rows are first located by primary key and locked, then deleted by (tableoid, ctid) and
+    backed up by a single DELETE ... RETURNING statement, so every record is always present in
+    exactly one of the two tables.
+    The changes are made in the current transaction, which is left for the caller to commit.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): The database cursor object.
+        table_name (str): Name of the table containing the records.
+        backup_table_name (str): Name of an existing table to back up the records to.
+        primary_key_field (str): Name of the primary key field.
+        primary_key_type (str): SQL type of the primary key field, as returned by get_column_type.
+        primary_key_values (List[Any]): List of primary key values identifying the records to move.
+    """
+    try:
+        # Resolve the physical row locations once. FOR UPDATE locks the rows until the
+        # transaction ends, so no concurrent update can move them before they are deleted.
+        cursor.execute(sql.SQL(
+            "SELECT tableoid, ctid FROM {src} WHERE {pk} IN (SELECT unnest(%s::{pk_type}[])) FOR UPDATE"
+        ).format(
+            src=sql.Identifier(table_name),
+            pk=sql.Identifier(primary_key_field),
+            pk_type=sql.SQL(primary_key_type)
+        ), (primary_key_values,))
+        locations = cursor.fetchall()
+        tableoids = [row[0] for row in locations]
+        ctids = [row[1] for row in locations]
+
+        # Delete the records by location and insert the deleted rows into the backup table.
+        # A ctid is only unique within one heap, so the tableoid is needed for partitioned
+        # and inherited tables.
+        cursor.execute(sql.SQL(
+            "WITH moved AS (DELETE FROM {src} WHERE (tableoid, ctid) IN (SELECT unnest(%s::oid[]), unnest(%s::tid[])) "
+            "RETURNING *) "
+            "INSERT INTO {dst} SELECT * FROM moved"
+        ).format(
+            src=sql.Identifier(table_name),
+            dst=sql.Identifier(backup_table_name)
+        ), (tableoids, ctids))
+
+        logger.info("%d records from %s moved successfully to %s.", cursor.rowcount, table_name, backup_table_name)
+    except psycopg2.Error as e:
+        logger.error("Error moving records: %s", e)
+        raise
 
 
 def remove_records(
-        connection: psycopg2.extensions.connection,
+        cursor: psycopg2.extensions.cursor,
         table_name: str,
         primary_key_field: str,
-        primary_key_values: List[Tuple]
+        primary_key_type: str,
+        primary_key_values: List[Any]
         ) -> None:
     """
     Remove records from the original table.
+    The changes are made in the current transaction, which is left for the caller to commit.
 
     Args:
-        connection (psycopg2.extensions.connection): The database connection object.
+        cursor (psycopg2.extensions.cursor): The database cursor object.
         table_name (str): Name of the table containing the records.
         primary_key_field (str): Name of the primary key field.
-        primary_key_values (List[Tuple]): List of primary key values.
+        primary_key_type (str): SQL type of the primary key field, as returned by get_column_type.
+        primary_key_values (List[Any]): List of primary key values.
 
     """
     try:
-        cursor = connection.cursor()
-
-        # Delete the sampled records from the original table
-        for primary_key_value in primary_key_values:
-            cursor.execute(sql.SQL("DELETE FROM {} WHERE {} = %s").format(
-                sql.Identifier(table_name),
-                sql.Identifier(primary_key_field)
-            ), primary_key_value)
-
-        connection.commit()
-        cursor.close()
-        print(f"Records {primary_key_values} removed successfully.")
+        # Delete the sampled records from the original table in a single statement
+        cursor.execute(sql.SQL("DELETE FROM {src} WHERE {pk} IN (SELECT unnest(%s::{pk_type}[]))").format(
+            src=sql.Identifier(table_name),
+            pk=sql.Identifier(primary_key_field),
+            pk_type=sql.SQL(primary_key_type)
+        ), (primary_key_values,))
+
+        logger.info("%d records removed successfully from %s.", cursor.rowcount, table_name)
     except psycopg2.Error as e:
-        connection.rollback()
-        print("Error backing up and removing records:", e)
+        logger.error("Error backing up and removing records: %s", e)
+        raise
 
 
 def restore_records(
-        connection: psycopg2.extensions.connection,
+        cursor: psycopg2.extensions.cursor,
         table_name: str,
         backup_table_name: str,
         primary_key_field: str,
-        primary_key_values: List[Tuple]
+        primary_key_type: str,
+        primary_key_values: List[Any]
         ) -> None:
     """
     Restores the identified records from the backup table to the original table.
+    The changes are made in the current transaction, which is left for the caller to commit.
 
     Args:
-        connection (psycopg2.extensions.connection): The database connection object.
+        cursor (psycopg2.extensions.cursor): The database cursor object.
         table_name (str): Name of the table to restore the records to.
         backup_table_name (str): Name of the backup table.
         primary_key_field (str): Name of the primary key field.
-        primary_key_values (List[Tuple]): List of primary key values identifying the records to restore.
+        primary_key_type (str): SQL type of the primary key field, as returned by get_column_type.
+        primary_key_values (List[Any]): List of primary key values identifying the records to restore.
     """
     try:
-        cursor = connection.cursor()
-
-        # Restore the identified records from the backup table
-        for primary_key_value in primary_key_values:
-            cursor.execute(sql.SQL("INSERT INTO {} SELECT * FROM {} WHERE {} = %s").format(
-                sql.Identifier(table_name),
-                sql.Identifier(backup_table_name),
-                sql.Identifier(primary_key_field)
-            ), primary_key_value)
-
-        connection.commit()
-        cursor.close()
-        print(f"Records {primary_key_values} restored successfully.")
+        # Restore the identified records from the backup table in a single statement
+        cursor.execute(sql.SQL(
+            "INSERT INTO {dst} SELECT * FROM {src} WHERE {pk} IN (SELECT unnest(%s::{pk_type}[]))"
+        ).format(
+            dst=sql.Identifier(table_name),
+            src=sql.Identifier(backup_table_name),
+            pk=sql.Identifier(primary_key_field),
+            pk_type=sql.SQL(primary_key_type)
+        ), (primary_key_values,))
+
+        logger.info("%d records restored successfully to %s.", cursor.rowcount, table_name)
     except psycopg2.Error as e:
-        connection.rollback()
-        print("Error restoring records:", e)
+        logger.error("Error restoring records: %s", e)
+        raise
 
 
 # Example usage
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     # Connect to the database
     connection = connect_to_database("localhost", 5432, "mydatabase", "myuser", "mypassword")
 
@@ -222,15 +331,21 @@ if __name__ == "__main__":
     primary_key_field = "customer_id"
     sample_size = 10
 
-    # Retrieve the primary key values from the table
-    primary_key_values = get_primary_key_values(connection, table_name, primary_key_field)
+    # Sample, backup, remove and restore the records in a single transaction using one cursor.
+    # The transaction is committed once at the end or rolled back if any step fails.
+    try:
+        with connection, connection.cursor() as cursor:
+            # Randomly sample records for simulation
+            sampled_primary_keys = [v[0] for v in sample_primary_key_values(cursor, table_name, primary_key_field, sample_size)]
+
+            # Look up the primary key type once for the whole run
+            primary_key_type = get_column_type(cursor, table_name, primary_key_field)
 
-    # Randomly sample records for simulation
-    sampled_primary_keys = sorted(random.sample(primary_key_values, sample_size))
+            backup_table_name = create_backup_table(cursor, table_name, backup_table_name)
+            move_records(cursor, table_name, backup_table_name, primary_key_field, primary_key_type, sampled_primary_keys)
+            restore_records(cursor, table_name, backup_table_name, primary_key_field, primary_key_type, sampled_primary_keys)
+    except psycopg2.Error:
+        logger.error("Simulation failed. All changes have been rolled back.")
 
-    # Backup and remove the randomly sampled records
-    backup_records(connection, table_name, backup_table_name, primary_key_field, sampled_primary_keys)
-    remove_records(connection, table_name, primary_key_field, sampled_primary_keys)
-    restore_records(connection, table_name, backup_table_name, primary_key_field, sampled_primary_keys)
     # Close the database connection
     connection.close()